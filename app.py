@@ -1,37 +1,70 @@
+import itertools
+import numpy as np
+import orjson
 import uvicorn
-from fastapi import FastAPI
-from collections import defaultdict
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel, confloat, conint
 from contextlib import asynccontextmanager
-from typing import Optional
-from samplers import UCBSampler, ThompsonSampler
+from typing import List, Optional
+from samplers import MAX_OFFER_ID, Stats, UCBSampler, ThompsonSampler
 
-# Dictionary to store recommendations for each click ID
-recommendations = {}
+# All module-level state below is only touched from the event loop thread
+# (every endpoint is async def), so it is deliberately not locked.
+# Declaring a handler with plain def would run it on a threadpool
+# and make these updates race.
 
-# Counter for the number of clicks each offer receives
-offer_clicks = defaultdict(int)
+# Number of slots in the recommendations ring buffer. A click waiting
+# for feedback is dropped once a click_id RECOMMENDATIONS_SIZE higher
+# lands on the same slot.
+RECOMMENDATIONS_SIZE = 1 << 20
 
-# Counter for the number of actions (conversions) for each offer
-offer_actions = defaultdict(int)
+# Pending recommendations as a ring buffer indexed by
+# click_id % RECOMMENDATIONS_SIZE: the click_id occupying each slot
+# (-1 when the slot is free) and the offer recommended for it
+recommended_clicks = np.full(RECOMMENDATIONS_SIZE, -1, dtype=np.int64)
+recommended_offers = np.zeros(RECOMMENDATIONS_SIZE, dtype=np.int64)
 
-# Cumulative rewards for each offer
-offer_rewards = defaultdict(float)
+# Clicks, actions (conversions) and cumulative rewards for each offer
+stats_table = Stats()
+
+# Serialized responses of the stats endpoint, invalidated on every update
+stats_cache = {}
+
+# Samplers are shared between requests, hyperparameters are passed per call
+ucb_sampler = UCBSampler(stats=stats_table)
+thompson_sampler = ThompsonSampler(stats=stats_table)
+
+# Offer IDs accepted by the sampling endpoints, larger ones get a 422
+OfferId = conint(ge=0, le=MAX_OFFER_ID)
+
+# Click IDs must be non-negative and fit into int64, others get a 422
+ClickId = conint(ge=0, le=np.iinfo(np.int64).max)
+
+# Sampler hyperparameters, NaN and infinity get a 422
+Hyperparameter = confloat(allow_inf_nan=False)
+
+
+class SampleItem(BaseModel):
+    """A single click in a /sample_batch/ request."""
+    click_id: ClickId
+    offer_ids: List[OfferId]
 
 
 def reset_stats():
     """
     Reset all statistics and clear data structures.
 
-    This function clears the following global dictionaries:
-    - recommendations: Stores click_id to offer_id mappings
-    - offer_clicks: Counts clicks for each offer
-    - offer_actions: Counts conversions for each offer
-    - offer_rewards: Sums rewards for each offer
+    This function clears the following global data structures:
+    - recommended_clicks, recommended_offers: Store pending
+    click_id to offer_id mappings
+    - stats_table: Counts clicks and conversions
+    and sums rewards for each offer
+    - stats_cache: Caches stats responses for each offer
     """
-    recommendations.clear()
-    offer_clicks.clear()
-    offer_actions.clear()
-    offer_rewards.clear()
+    recommended_clicks.fill(-1)
+    stats_table.reset()
+    stats_cache.clear()
 
 
 # For newer versions of FastAPI:
@@ -43,12 +76,12 @@ async def lifespan(app: FastAPI):
     yield
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 
 # For older versions of FastAPI:
 
-# app = FastAPI()
+# app = FastAPI(default_response_class=ORJSONResponse)
 
 
 # @app.on_event("startup")
@@ -57,16 +90,13 @@ app = FastAPI(lifespan=lifespan)
 #     Initialize statistics when the application starts.
 
 #     This function is called automatically when the FastAPI application starts.
-#     It clears all global dictionaries to ensure a clean state at startup.
+#     It clears all global data structures to ensure a clean state at startup.
 #     """
-#     recommendations.clear()
-#     offer_clicks.clear()
-#     offer_actions.clear()
-#     offer_rewards.clear()
+#     reset_stats()
 
 
 @app.put("/feedback/")
-def feedback(click_id: int, reward: float) -> dict:
+async def feedback(click_id: ClickId, reward: float) -> ORJSONResponse:
     """
     Process feedback for a particular click and update statistics.
 
@@ -75,23 +105,32 @@ def feedback(click_id: int, reward: float) -> dict:
         reward (float): The reward value associated with the click.
 
     Returns:
-        dict: A dictionary containing feedback information:
+        ORJSONResponse: A JSON response containing feedback information:
             - click_id: The ID of the processed click
             - offer_id: The ID of the offer associated with the click
             - is_conversion: Boolean indicating
             whether the click resulted in a conversion
             - reward: The reward value received
 
+    Raises:
+        HTTPException: 404 if there is no pending recommendation
+        for click_id.
+
     This function updates offer statistics based on the feedback received:
     - Removes the click_id from recommendations
-    - Updates offer_rewards and offer_actions if a conversion occurred
+    - Updates offer rewards and actions if a conversion occurred
     """
-    offer_id = recommendations[click_id]
-    del recommendations[click_id]
+    slot = click_id % RECOMMENDATIONS_SIZE
+    if recommended_clicks[slot] != click_id:
+        raise HTTPException(
+            status_code=404, detail=f"Unknown click_id: {click_id}"
+        )
+    recommended_clicks[slot] = -1
+    offer_id = int(recommended_offers[slot])
 
     if reward > 0:
-        offer_rewards[offer_id] += reward
-        offer_actions[offer_id] += 1
+        stats_table.add_conversion(offer_id, reward)
+        stats_cache.pop(offer_id, None)
         is_conversion = True
     else:
         is_conversion = False
@@ -103,19 +142,44 @@ def feedback(click_id: int, reward: float) -> dict:
         "reward": reward,
     }
 
-    return response
+    return ORJSONResponse(response)
+
+
+def compute_stats(offer_id: int) -> dict:
+    """
+    Calculate performance metrics for a specific offer.
+
+    Args:
+        offer_id (int): The unique identifier of the offer.
+
+    Returns:
+        dict: The response body of the stats endpoint.
+    """
+    clicks, actions, rewards, cr, rpc = stats_table.gather(
+        [offer_id], "clicks", "actions", "rewards", "cr", "rpc"
+    )
+
+    return {
+        "offer_id": offer_id,
+        "clicks": int(clicks[0]),
+        "conversions": int(actions[0]),
+        "reward": float(rewards[0]),
+        "cr": float(cr[0]),
+        "rpc": float(rpc[0]),
+    }
 
 
 @app.get("/offer_ids/{offer_id}/stats/")
-def stats(offer_id: int) -> dict:
+async def stats(offer_id: OfferId) -> Response:
     """
     Retrieve statistics for a specific offer.
 
     Args:
         offer_id (int): The unique identifier of the offer.
+        IDs outside [0, MAX_OFFER_ID] are rejected with a 422.
 
     Returns:
-        dict: A dictionary containing the following statistics for the offer:
+        Response: A JSON response with the following statistics for the offer:
             - offer_id: The ID of the offer
             - clicks: Total number of clicks for the offer
             - conversions: Total number of conversions for the offer
@@ -123,35 +187,37 @@ def stats(offer_id: int) -> dict:
             - cr: Conversion rate (conversions / clicks)
             - rpc: Revenue per click (total reward / clicks)
 
-    This function calculates and returns
-    various performance metrics (stats) for the specified offer.
+    This function returns various performance metrics (stats)
+    for the specified offer. The serialized metrics are cached per offer
+    until the next click or conversion on it.
     """
-    response = {
-        "offer_id": offer_id,
-        "clicks": offer_clicks[offer_id],
-        "conversions": offer_actions[offer_id],
-        "reward": offer_rewards[offer_id],
-        "cr": offer_actions[offer_id] / max(offer_clicks[offer_id], 1),
-        "rpc": offer_rewards[offer_id] / max(offer_clicks[offer_id], 1),
-    }
-    return response
+    content = stats_cache.get(offer_id)
+    if content is None:
+        response = compute_stats(offer_id)
+        content = orjson.dumps(response)
+        # Unseen offers are not cached so lookups cannot grow the cache
+        if response["clicks"]:
+            stats_cache[offer_id] = content
+    return Response(content, media_type="application/json")
 
 
 @app.get("/sample/")
-def sample(
-    click_id: int,
-    offer_ids: str,
+async def sample(
+    click_id: ClickId,
+    offer_ids: List[OfferId] = Query(...),
     sampler: Optional[str] = "ucb",
-    ucb_c: Optional[float] = 1.0,
-    thompson_a: Optional[float] = 1.0,
-    thompson_b: Optional[float] = 1.0
-) -> dict:
+    ucb_c: Optional[Hyperparameter] = 1.0,
+    thompson_a: Optional[Hyperparameter] = 1.0,
+    thompson_b: Optional[Hyperparameter] = 1.0
+) -> ORJSONResponse:
     """
     Sample a random offer using the specified sampling strategy.
 
     Args:
         click_id (int): The unique identifier for the current click.
-        offer_ids (str): A comma-separated string of offer IDs to choose from.
+        offer_ids (List[int]): The offer IDs to choose from, passed as
+        repeated query parameters (?offer_ids=1&offer_ids=2).
+        IDs above MAX_OFFER_ID are rejected with a 422.
         sampler (str, optional): The sampling strategy to use.
         Either "ucb" or "thompson". Defaults to "ucb".
         ucb_c (float, optional): The exploration parameter for UCB sampling.
@@ -162,7 +228,7 @@ def sample(
         in Thompson sampling. Defaults to 1.0.
 
     Returns:
-        dict: A dictionary containing:
+        ORJSONResponse: A JSON response containing:
             - click_id: The ID of the current click
             - offer_id: The ID of the sampled offer
 
@@ -170,43 +236,140 @@ def sample(
         ValueError: If an unknown sampler is specified.
 
     This function selects an offer using either UCB or Thompson sampling,
-    updates the recommendations and offer_clicks dictionaries,
+    updates the recommendations and the offer click counts,
     and returns the sampled offer ID.
     """
-    offers_ids = [int(offer) for offer in offer_ids.split(",")]
+    offers_ids = np.array(offer_ids, dtype=np.int64)
 
     if sampler == "ucb":
-        ucb_sampler = UCBSampler(
-            ucb_c, offer_clicks, offer_actions, offer_rewards
-        )
-        offer_id = ucb_sampler.sample(offers_ids, click_id)
+        offer_id = ucb_sampler.sample(offers_ids, click_id, ucb_c)
     elif sampler == "thompson":
-        thompson_sampler = ThompsonSampler(
-            thompson_a, thompson_b, offer_clicks, offer_actions, offer_rewards
+        offer_id = thompson_sampler.sample(
+            offers_ids, thompson_a, thompson_b
         )
-        offer_id = thompson_sampler.sample(offers_ids)
     else:
         raise ValueError(f"Unknown sampler: {sampler}")
 
-    recommendations[click_id] = offer_id
-    offer_clicks[offer_id] += 1
+    slot = click_id % RECOMMENDATIONS_SIZE
+    recommended_clicks[slot] = click_id
+    recommended_offers[slot] = offer_id
+    stats_table.add_click(offer_id)
+    stats_cache.pop(offer_id, None)
 
     response = {
         "click_id": click_id,
         "offer_id": offer_id
     }
 
-    return response
+    return ORJSONResponse(response)
+
+
+@app.post("/sample_batch/")
+async def sample_batch(
+    items: List[SampleItem],
+    sampler: Optional[str] = "ucb",
+    ucb_c: Optional[Hyperparameter] = 1.0,
+    thompson_a: Optional[Hyperparameter] = 1.0,
+    thompson_b: Optional[Hyperparameter] = 1.0
+) -> ORJSONResponse:
+    """
+    Sample offers for a batch of clicks using the specified strategy.
+
+    Args:
+        items (List[SampleItem]): The clicks to sample offers for,
+        each with its own click_id and list of offer IDs.
+        sampler (str, optional): The sampling strategy to use.
+        Either "ucb" or "thompson". Defaults to "ucb".
+        ucb_c (float, optional): The exploration parameter for UCB sampling.
+        Defaults to 1.0.
+        thompson_a (float, optional): Hyperparameter for alpha
+        in Thompson sampling. Defaults to 1.0.
+        thompson_b (float, optional): Hyperparameter for beta
+        in Thompson sampling. Defaults to 1.0.
+
+    Returns:
+        ORJSONResponse: A JSON list with one entry per item containing:
+            - click_id: The ID of the click
+            - offer_id: The ID of the sampled offer
 
+    Raises:
+        ValueError: If an unknown sampler is specified.
+        HTTPException: 422 if an item has no offer IDs.
 
-def main() -> None:
+    All clicks of the batch are scored in a single vectorized pass
+    against the same statistics, so they do not see each other's clicks.
+    The recommendations and offer click counts are updated afterwards.
+    """
+    if not items:
+        return ORJSONResponse([])
+
+    lengths = np.fromiter(
+        (len(item.offer_ids) for item in items),
+        dtype=np.int64, count=len(items)
+    )
+    if not lengths.all():
+        raise HTTPException(
+            status_code=422, detail="Every item needs at least one offer ID"
+        )
+    click_ids = np.fromiter(
+        (item.click_id for item in items), dtype=np.int64, count=len(items)
+    )
+    offers_ids = np.fromiter(
+        itertools.chain.from_iterable(item.offer_ids for item in items),
+        dtype=np.int64, count=int(lengths.sum())
+    )
+
+    if sampler == "ucb":
+        chosen = ucb_sampler.sample_batch(
+            offers_ids, lengths, click_ids, ucb_c
+        )
+    elif sampler == "thompson":
+        chosen = thompson_sampler.sample_batch(
+            offers_ids, lengths, thompson_a, thompson_b
+        )
+    else:
+        raise ValueError(f"Unknown sampler: {sampler}")
+
+    # Later items win when several click IDs share a ring buffer slot
+    slots = click_ids % RECOMMENDATIONS_SIZE
+    recommended_clicks[slots] = click_ids
+    recommended_offers[slots] = chosen
+    stats_table.add_clicks(chosen)
+    for offer_id in np.unique(chosen).tolist():
+        stats_cache.pop(offer_id, None)
+
+    response = [
+        {"click_id": click_id, "offer_id": offer_id}
+        for click_id, offer_id in zip(click_ids.tolist(), chosen.tolist())
+    ]
+
+    return ORJSONResponse(response)
+
+
+def main(workers: int = 1) -> None:
     """
     Run the FastAPI application using uvicorn.
 
-    This function starts the FastAPI server using uvicorn,
+    Args:
+        workers (int, optional): Number of worker processes.
+        Defaults to 1.
+
+    This function starts the FastAPI server using uvicorn
+    with the uvloop event loop and the httptools HTTP parser,
     hosting the application on localhost.
+
+    Note that all statistics live in process memory, so every worker
+    keeps its own copy and feedback must reach the worker that served
+    the sample. Keep a single worker unless the state is moved
+    to a shared store.
     """
-    uvicorn.run("app:app", host="localhost")
+    uvicorn.run(
+        "app:app",
+        host="localhost",
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
+    )
 
 
 if __name__ == "__main__":
@@ -1,31 +1,253 @@
+import math
+from dataclasses import dataclass, field, fields
+
 import numpy as np
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional, fall back to plain NumPy
+    njit = None
+
+# Number of offer rows preallocated by Stats
+INITIAL_CAPACITY = 1024
+
+# Largest offer ID Stats accepts, caps the arrays at ~32 MB
+MAX_OFFER_ID = (1 << 20) - 1
+
+# Random generator used by ThompsonSampler
+_rng = np.random.default_rng()
+
+
+def _zeros() -> np.ndarray:
+    return np.zeros(INITIAL_CAPACITY, dtype=np.float64)
+
+
+def _counters() -> np.ndarray:
+    # 32-bit counters halve their footprint, and still count
+    # up to ~4.3 billion clicks per offer
+    return np.zeros(INITIAL_CAPACITY, dtype=np.uint32)
+
+
+@dataclass
+class Stats:
+    """
+    Per-offer statistics stored as contiguous arrays indexed by offer_id.
+
+    Offer IDs are used directly as row indices, so they must be
+    integers between 0 and MAX_OFFER_ID. The arrays grow on demand
+    (doubling their capacity) when a larger offer_id is seen.
+    Clicks and actions are uint32 counters, everything else is float64,
+    about 32 bytes per offer.
+
+    Conversion rate (cr) and revenue per click (rpc) are kept up to date
+    on every click and conversion, so samplers only have to gather them.
+
+    Stats is not thread-safe. The app only touches it from the event loop
+    thread (all its handlers are async def), so updates never interleave.
+    """
+    clicks: np.ndarray = field(default_factory=_counters)
+    actions: np.ndarray = field(default_factory=_counters)
+    rewards: np.ndarray = field(default_factory=_zeros)
+    cr: np.ndarray = field(default_factory=_zeros)
+    rpc: np.ndarray = field(default_factory=_zeros)
+
+    def reset(self) -> None:
+        """Drop all statistics and shrink back to the initial capacity."""
+        for column in fields(self):
+            setattr(self, column.name, column.default_factory())
+
+    def ensure_capacity(self, offers_ids) -> np.ndarray:
+        """
+        Grow the arrays so that every offer in offers_ids has a row.
+
+        Only called on writes, see gather().
+
+        Returns:
+            np.ndarray: offers_ids as an int64 index array.
+
+        Raises:
+            ValueError: If any offer ID is outside [0, MAX_OFFER_ID].
+        """
+        idx = np.asarray(offers_ids, dtype=np.int64)
+        if idx.size == 0:
+            return idx
+        if idx.min() < 0 or idx.max() > MAX_OFFER_ID:
+            raise ValueError(
+                f"Offer IDs must be integers between 0 and {MAX_OFFER_ID}"
+            )
+
+        capacity = len(self.clicks)
+        required = int(idx.max()) + 1
+        if required > capacity:
+            capacity = max(2 * capacity, required)
+            capacity = min(capacity, MAX_OFFER_ID + 1)
+            for column in fields(self):
+                old = getattr(self, column.name)
+                new = np.zeros(capacity, dtype=old.dtype)
+                new[:len(old)] = old
+                setattr(self, column.name, new)
+        return idx
+
+    def gather(self, offers_ids, *columns: str) -> tuple:
+        """
+        Return the requested columns for the given offers.
+
+        Reads never grow the arrays: offers without a row yet
+        get zeros for every column.
+
+        Example:
+            clicks, cr = stats.gather(offers_ids, "clicks", "cr")
+        """
+        idx = np.asarray(offers_ids, dtype=np.int64)
+        known = (idx >= 0) & (idx < len(self.clicks))
+        if known.all():
+            return tuple(getattr(self, column)[idx] for column in columns)
+
+        result = []
+        for column in columns:
+            data = getattr(self, column)
+            values = np.zeros(len(idx), dtype=data.dtype)
+            values[known] = data[idx[known]]
+            result.append(values)
+        return tuple(result)
+
+    def add_click(self, offer_id: int) -> None:
+        self.ensure_capacity([offer_id])
+        self.clicks[offer_id] += 1
+        self._update_rates(offer_id)
+
+    def add_clicks(self, offers_ids: np.ndarray) -> None:
+        """Add one click per entry of offers_ids (repeats are counted)."""
+        idx = self.ensure_capacity(offers_ids)
+        np.add.at(self.clicks, idx, 1)
+        self._update_rates(np.unique(idx))
+
+    def add_conversion(self, offer_id: int, reward: float) -> None:
+        self.ensure_capacity([offer_id])
+        self.rewards[offer_id] += reward
+        self.actions[offer_id] += 1
+        self._update_rates(offer_id)
+
+    def _update_rates(self, offer_id) -> None:
+        denom = np.maximum(self.clicks[offer_id], 1.0)
+        self.cr[offer_id] = self.actions[offer_id] / denom
+        self.rpc[offer_id] = self.rewards[offer_id] / denom
+
+
+def _segment_argmax(values: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Return the index of the first maximum of each segment of values.
+
+    Segments are consecutive and non-empty, segment i has lengths[i] items.
+    NaN values never win, so a NaN cannot shift hits between segments.
+    """
+    values = np.where(np.isnan(values), -np.inf, values)
+    starts = np.cumsum(lengths) - lengths
+    segment_max = np.maximum.reduceat(values, starts)
+    hits = np.flatnonzero(values == np.repeat(segment_max, lengths))
+    return hits[np.searchsorted(hits, starts)]
+
+
+def _ucb_argmax(
+        clicks: np.ndarray,
+        cr: np.ndarray,
+        rpc: np.ndarray,
+        explore: float
+) -> int:
+    """
+    Return the index of the offer with the highest rpc * ucb score.
+
+    Offers that have not been clicked yet have an infinite UCB bonus,
+    so the first of them is returned right away.
+
+    Single pass over the arrays without intermediate allocations;
+    compiled with numba when it is installed.
+    """
+    best = 0
+    best_score = 0.0
+    for i in range(clicks.shape[0]):
+        if clicks[i] == 0:
+            return i
+        score = rpc[i] * (cr[i] + explore / clicks[i])
+        if i == 0 or score > best_score:
+            best = i
+            best_score = score
+    return best
+
+
+if njit is not None:
+    # Compiled eagerly at import, so no request pays for the JIT compile
+    # on the event loop. The dtypes match the Stats columns.
+    _ucb_argmax = njit(
+        "int64(uint32[:], float64[:], float64[:], float64)", cache=True
+    )(_ucb_argmax)
+
 
 class UCBSampler:
     def __init__(
             self,
             ucb_c: float = 1.0,
-            offer_clicks: dict = None,
-            offer_actions: dict = None,
-            offer_rewards: dict = None
+            stats: Stats = None
     ):
         self.ucb_c = ucb_c
-        self.offer_clicks = offer_clicks
-        self.offer_actions = offer_actions
-        self.offer_rewards = offer_rewards
-
-    def sample(self, offers_ids: list, click_id: int) -> int:
-        rpc_ucb = {}
-        for offer in offers_ids:
-            clicks = self.offer_clicks.get(offer, 0)
-            reward = self.offer_rewards.get(offer, 0)
-            cr = self.offer_actions[offer] / max(clicks, 1)
-            rpc = reward / max(clicks, 1)
-            ucb = cr + self.ucb_c * np.sqrt(
-                np.log1p(click_id)) / max(clicks, 1
-                                          )
-            rpc_ucb[offer] = rpc * ucb
-        return max(rpc_ucb, key=rpc_ucb.get)
+        self.stats = stats
+
+    def sample(
+            self,
+            offers_ids: np.ndarray,
+            click_id: int,
+            ucb_c: float = None
+    ) -> int:
+        if ucb_c is None:
+            ucb_c = self.ucb_c
+        clicks, cr, rpc = self.stats.gather(offers_ids, "clicks", "cr", "rpc")
+
+        # Exploration term numerator is the same for every offer
+        explore = ucb_c * math.sqrt(math.log1p(click_id))
+
+        if njit is not None:
+            return int(
+                offers_ids[_ucb_argmax(clicks, cr, rpc, explore)]
+            )
+
+        # Untried offers have an infinite UCB bonus, explore them first
+        untried = clicks == 0
+        if untried.any():
+            return int(offers_ids[untried.argmax()])
+
+        # scores = rpc * (cr + explore / clicks), without extra temporaries
+        scores = np.divide(explore, clicks)
+        scores += cr
+        scores *= rpc
+        return int(offers_ids[scores.argmax()])
+
+    def sample_batch(
+            self,
+            offers_ids: np.ndarray,
+            lengths: np.ndarray,
+            click_ids: np.ndarray,
+            ucb_c: float = None
+    ) -> np.ndarray:
+        """
+        Sample one offer for each of several clicks at once.
+
+        offers_ids holds the candidate offers of all clicks back to back,
+        lengths[i] is the number of candidates of click_ids[i].
+        Every click is scored against the same statistics snapshot.
+        """
+        if ucb_c is None:
+            ucb_c = self.ucb_c
+        clicks, cr, rpc = self.stats.gather(offers_ids, "clicks", "cr", "rpc")
+
+        explore = np.repeat(ucb_c * np.sqrt(np.log1p(click_ids)), lengths)
+        untried = clicks == 0
+
+        scores = np.divide(explore, np.maximum(clicks, 1.0))
+        scores += cr
+        scores *= rpc
+        # Untried offers have an infinite UCB bonus, explore them first
+        scores[untried] = np.inf
+        return offers_ids[_segment_argmax(scores, lengths)]
 
 
 class ThompsonSampler:
@@ -33,32 +255,67 @@ class ThompsonSampler:
             self,
             thompson_a: float = 1.0,
             thompson_b: float = 1.0,
-            offer_clicks: dict = None,
-            offer_actions: dict = None,
-            offer_rewards: dict = None
+            stats: Stats = None
     ):
         self.thompson_a = thompson_a
         self.thompson_b = thompson_b
-        self.offer_clicks = offer_clicks
-        self.offer_actions = offer_actions
-        self.offer_rewards = offer_rewards
-
-    def sample(self, offers_ids: list) -> int:
-        alpha = np.array(
-            [self.offer_actions[offer] for offer in offers_ids])  # successes
-        beta = np.array(
-            [self.offer_clicks[offer] - self.offer_actions[offer]
-             for offer in offers_ids]
-            )  # failures
-
-        if sum(alpha) == 0:
-            return int(np.random.choice(offers_ids))
-        else:
-            cr = np.random.beta(
-                alpha + self.thompson_a, beta + self.thompson_b
-            )
-            rpc = np.array(
-                [self.offer_rewards[offer] / max(self.offer_clicks[offer], 1)
-                 for offer in offers_ids]
-            )
-            return offers_ids[np.argmax(cr * rpc)]
+        self.stats = stats
+
+    def sample(
+            self,
+            offers_ids: np.ndarray,
+            thompson_a: float = None,
+            thompson_b: float = None
+    ) -> int:
+        if thompson_a is None:
+            thompson_a = self.thompson_a
+        if thompson_b is None:
+            thompson_b = self.thompson_b
+        clicks, actions, rpc = self.stats.gather(
+            offers_ids, "clicks", "actions", "rpc"
+        )
+
+        alpha = actions  # successes
+        beta = clicks - actions  # failures
+
+        if not actions.any():
+            return int(_rng.choice(offers_ids))
+
+        cr = _rng.beta(alpha + thompson_a, beta + thompson_b)
+        np.multiply(cr, rpc, out=cr)
+        return int(offers_ids[cr.argmax()])
+
+    def sample_batch(
+            self,
+            offers_ids: np.ndarray,
+            lengths: np.ndarray,
+            thompson_a: float = None,
+            thompson_b: float = None
+    ) -> np.ndarray:
+        """
+        Sample one offer for each of several clicks at once.
+
+        offers_ids holds the candidate offers of all clicks back to back,
+        lengths[i] is the number of candidates of the i-th click.
+        Every click is scored against the same statistics snapshot.
+        """
+        if thompson_a is None:
+            thompson_a = self.thompson_a
+        if thompson_b is None:
+            thompson_b = self.thompson_b
+        clicks, actions, rpc = self.stats.gather(
+            offers_ids, "clicks", "actions", "rpc"
+        )
+
+        cr = _rng.beta(actions + thompson_a, clicks - actions + thompson_b)
+        np.multiply(cr, rpc, out=cr)
+        chosen = _segment_argmax(cr, lengths)
+
+        # Clicks without any conversions among their offers
+        # get a uniformly random offer, as in sample()
+        starts = np.cumsum(lengths) - lengths
+        cold = np.add.reduceat(actions, starts) == 0
+        if cold.any():
+            random_idx = starts + (_rng.random(len(lengths)) * lengths)
+            chosen[cold] = random_idx.astype(np.int64)[cold]
+        return offers_ids[chosen]
@@ -0,0 +1,75 @@
+import numpy as np
+
+from samplers import Stats, ThompsonSampler, UCBSampler, _segment_argmax
+
+
+def make_stats(n_offers: int = 300, n_events: int = 5000) -> Stats:
+    """Random statistics where some offers are never clicked."""
+    rng = np.random.default_rng(0)
+    stats = Stats()
+    for _ in range(n_events):
+        offer_id = int(rng.integers(0, n_offers))
+        stats.add_click(offer_id)
+        if rng.random() < 0.2:
+            stats.add_conversion(offer_id, float(rng.random() * 5))
+    return stats
+
+
+def make_batch(max_offer_id: int, n_items: int = 100) -> tuple:
+    """Random batch of (offers_ids, lengths) split into segments."""
+    rng = np.random.default_rng(1)
+    segments = [
+        rng.integers(0, max_offer_id, int(rng.integers(1, 20)))
+        for _ in range(n_items)
+    ]
+    lengths = np.array([len(segment) for segment in segments])
+    return segments, np.concatenate(segments), lengths
+
+
+def test_ucb_sample_batch_matches_sample():
+    stats = make_stats()
+    sampler = UCBSampler(stats=stats)
+    # IDs above 300 are unseen, so the untried fast path is covered too
+    segments, offers_ids, lengths = make_batch(max_offer_id=320)
+    click_ids = np.arange(len(segments)) * 7
+
+    batch = sampler.sample_batch(offers_ids, lengths, click_ids)
+    single = [
+        sampler.sample(segment, int(click_id))
+        for segment, click_id in zip(segments, click_ids)
+    ]
+    assert batch.tolist() == single
+
+
+def test_thompson_sample_batch_picks_from_own_segment():
+    stats = make_stats()
+    sampler = ThompsonSampler(stats=stats)
+    segments, offers_ids, lengths = make_batch(max_offer_id=320)
+
+    batch = sampler.sample_batch(offers_ids, lengths)
+    assert len(batch) == len(segments)
+    for offer_id, segment in zip(batch, segments):
+        assert offer_id in segment
+
+
+def test_thompson_sample_batch_cold_start():
+    sampler = ThompsonSampler(stats=Stats())
+    offers_ids = np.array([1, 2, 3, 4, 5])
+    lengths = np.array([2, 3])
+
+    first, second = sampler.sample_batch(offers_ids, lengths)
+    assert first in (1, 2)
+    assert second in (3, 4, 5)
+
+
+def test_segment_argmax_first_max_per_segment():
+    values = np.array([1.0, 3.0, 3.0, 2.0, 5.0, 5.0])
+    assert _segment_argmax(values, np.array([3, 1, 2])).tolist() == [1, 3, 4]
+
+
+def test_segment_argmax_ignores_nan():
+    nan = np.nan
+    values = np.array([nan, 1.0, nan, nan, 2.0, 5.0])
+    # An all-NaN segment must still pick one of its own indices
+    result = _segment_argmax(values, np.array([2, 2, 2]))
+    assert result.tolist() == [1, 2, 5]